@@ -25,6 +25,10 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:/
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
+    # One connection per gunicorn thread (--threads in .replit), plus headroom
+    # for background work such as the analytics refresher
+    "pool_size": int(os.environ.get("DB_POOL_SIZE", 32)),
+    "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 8)),
 }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
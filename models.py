@@ -65,7 +65,9 @@ class StudentProfile(db.Model):
     subjects_of_interest = db.Column(db.String(256))
     difficulty_level = db.Column(db.Integer, default=1)  # 1-5 scale
     streak_days = db.Column(db.Integer, default=0)
-    points = db.Column(db.Integer, default=0)
+    # active_history loads the old value on assignment, so the change logged
+    # to PointsEvent is right even when the profile was expired by a commit
+    points = db.column_property(db.Column(db.Integer, default=0), active_history=True)
     last_active = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Learning analytics
@@ -176,3 +178,58 @@ class OfflineContent(db.Model):
     
     # The associated content
     content = db.relationship('LearningContent')
+
+
+# Pre-aggregated engagement metrics for one scope over one hour or day,
+# maintained by utils.analytics
+class EngagementRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(20), nullable=False)  # student, grade, class, school
+    scope_key = db.Column(db.String(160), nullable=False)
+    granularity = db.Column(db.String(10), nullable=False)  # hour, day
+    period_start = db.Column(db.DateTime, nullable=False)
+    
+    # Additive measures, so rollups can be summed over any time range
+    engagement_sum = db.Column(db.Float, default=0)
+    engagement_count = db.Column(db.Integer, default=0)
+    activities_started = db.Column(db.Integer, default=0)
+    activities_completed = db.Column(db.Integer, default=0)
+    session_seconds = db.Column(db.Float, default=0)
+    emotion_counts = db.Column(db.JSON)  # emotion -> count
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'scope_key', 'granularity', 'period_start', name='uq_engagement_rollup_period'),
+    )
+
+
+# How far each raw table has been folded into the rollups
+class AnalyticsWatermark(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, default=0)
+    last_time = db.Column(db.DateTime)
+
+
+# Append-only log of StudentProfile.points changes, written by utils.leaderboard
+class PointsEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    points_after = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+# Content hash of each lesson, used to skip duplicates on bulk ingestion.
+# Kept in its own table so create_all() adds it to existing databases.
+class ContentFingerprint(db.Model):
+    content_hash = db.Column(db.String(64), primary_key=True)
+    content_id = db.Column(db.Integer, db.ForeignKey('learning_content.id'), nullable=False)
+
+
+class TranslationJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    content_id = db.Column(db.Integer, db.ForeignKey('learning_content.id'), nullable=False)
+    target_language = db.Column(Enum(Language), nullable=False)
+    status = db.Column(db.String(20), default='pending', index=True)  # pending, done, failed
+    translated_content_id = db.Column(db.Integer, db.ForeignKey('learning_content.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -1,5 +1,7 @@
 import os
+import asyncio
 import logging
+import click
 from flask import render_template, request, redirect, url_for, flash, jsonify, session
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -11,14 +13,12 @@ from models import (
     LearningActivity, Achievement, EmotionLog, LearningStyle,
     Language, EmotionalState, LearningStyleAssessment, MentorStudentRelationship
 )
-from utils.ai_services import (
-    generate_personalized_content, analyze_student_response,
-    get_multilingual_content, recommend_content
-)
+from utils.ai_services import get_multilingual_content, recommend_content
 # Import vision services with error handling
 try:
     from utils.vision_services import (
-        detect_emotion, track_engagement, analyze_learning_state
+        detect_emotion, fallback_emotion_detection, track_engagement,
+        analyze_learning_state
     )
 except ImportError as e:
     logging.warning(f"Could not import vision services: {e}")
@@ -35,6 +35,8 @@ except ImportError as e:
             }
         }
     
+    fallback_emotion_detection = detect_emotion
+    
     def track_engagement(image_file):
         logging.warning("Using fallback engagement tracking")
         return {
@@ -52,11 +54,25 @@ except ImportError as e:
             'learning_state': 'passive_learning',
             'recommendations': ['Take a short break before continuing']
         }
-from utils.language_services import translate_content, detect_language
+from utils.async_ai_services import (
+    generate_personalized_content_async, analyze_student_response_async,
+    translate_content_async, detect_language_async
+)
 from utils.learning_utils import (
     assess_learning_style, update_student_progress,
     award_achievement, calculate_streak
 )
+from utils.analytics import (
+    ANALYTICS_SCOPES, GRANULARITIES, scope_key_for_user, can_view_analytics,
+    refresh_rollups, start_rollup_refresher, get_engagement_summary
+)
+from utils.leaderboard import (
+    LEADERBOARD_SCOPES, LEADERBOARD_WINDOWS, get_leaderboard
+)
+from utils.content_ingest import ingest_content, process_translation_jobs
+from utils.admission_control import (
+    admission_controlled, admission_slot, is_degraded, get_admission_status
+)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -208,32 +224,58 @@ def learn():
         student=student_profile
     )
 
+def _load_learning_content(content_id):
+    content = LearningContent.query.get_or_404(content_id)
+    # Loaded through the relationship so base.html can still read it below
+    student_profile = current_user.student_profile
+    # Return the connection before waiting on OpenAI. The lesson is detached
+    # from here on, so a translation shown to this reader is never saved.
+    db.session.close()
+    return content, student_profile
+
+def _start_learning_activity(user_id, content_id):
+    activity = LearningActivity(
+        user_id=user_id,
+        content_id=content_id,
+        start_time=datetime.utcnow()
+    )
+    db.session.add(activity)
+    db.session.flush()
+    activity_id = activity.id
+    db.session.commit()
+    return activity_id
+
 @app.route('/learn/<int:content_id>')
 @login_required
-def learn_content(content_id):
-    content = LearningContent.query.get_or_404(content_id)
-    student_profile = StudentProfile.query.filter_by(user_id=current_user.id).first()
+async def learn_content(content_id):
+    # Database work runs in a worker thread to keep the event loop free
+    content, student_profile = await asyncio.to_thread(_load_learning_content, content_id)
     
     # Check if we need to translate content
+    # Translation fans out to several OpenAI calls, so it runs under the 'llm'
+    # limits; when they are exhausted the lesson is shown untranslated
     if content.language != current_user.preferred_language:
-        translated_content = translate_content(
-            content.content,
-            str(content.language.value),
-            str(current_user.preferred_language.value)
-        )
-        content.content = translated_content
+        complete = False
+        async with admission_slot('llm') as admitted:
+            if admitted:
+                translated_content, complete = await translate_content_async(
+                    content.content,
+                    str(content.language.value),
+                    str(current_user.preferred_language.value)
+                )
+        
+        if complete:
+            content.content = translated_content
+        else:
+            flash('Translation is not available right now, showing the original lesson', 'info')
     
     # Record learning activity start
-    activity = LearningActivity(
-        user_id=current_user.id,
-        content_id=content_id,
-        start_time=datetime.utcnow()
+    activity_id = await asyncio.to_thread(
+        _start_learning_activity, current_user.id, content_id
     )
-    db.session.add(activity)
-    db.session.commit()
     
     # Store activity ID in session for tracking
-    session['current_activity_id'] = activity.id
+    session['current_activity_id'] = activity_id
     
     return render_template('learn_content.html', content=content, student=student_profile)
 
@@ -366,9 +408,15 @@ def request_mentor(mentor_id):
     return redirect(url_for('mentors'))
 
 # AI and Vision API routes
+def _load_student_profile(user_id):
+    student_profile = StudentProfile.query.filter_by(user_id=user_id).first()
+    db.session.close()  # don't hold a connection while waiting on OpenAI
+    return student_profile
+
 @app.route('/api/generate_content', methods=['POST'])
 @login_required
-def api_generate_content():
+@admission_controlled('llm')
+async def api_generate_content():
     topic = request.form.get('topic')
     subject = request.form.get('subject')
     difficulty = request.form.get('difficulty', 1)
@@ -377,11 +425,11 @@ def api_generate_content():
         return jsonify({'error': 'Missing required parameters'}), 400
     
     # Get student profile
-    student_profile = StudentProfile.query.filter_by(user_id=current_user.id).first()
+    student_profile = await asyncio.to_thread(_load_student_profile, current_user.id)
     
     # Generate personalized content
     try:
-        content = generate_personalized_content(
+        content = await generate_personalized_content_async(
             topic=topic,
             subject=subject,
             difficulty=difficulty,
@@ -395,8 +443,41 @@ def api_generate_content():
         logging.error(f"Error generating content: {str(e)}")
         return jsonify({'error': 'Failed to generate content'}), 500
 
+@app.route('/api/analyze_answer', methods=['POST'])
+@login_required
+@admission_controlled('llm')
+async def api_analyze_answer():
+    data = request.get_json() or {}
+    question = data.get('question')
+    answer = data.get('answer')
+    
+    if not question or not answer:
+        return jsonify({'error': 'Missing required parameters'}), 400
+    
+    try:
+        analysis = await analyze_student_response_async(
+            question, answer, current_user.grade_level
+        )
+        return jsonify(analysis)
+    except Exception as e:
+        logging.error(f"Error analyzing answer: {str(e)}")
+        return jsonify({'error': 'Failed to analyze answer'}), 500
+
+@app.route('/api/detect_language', methods=['POST'])
+@login_required
+@admission_controlled('llm')
+async def api_detect_language():
+    text = (request.get_json() or {}).get('text')
+    
+    if not text:
+        return jsonify({'error': 'No text provided'}), 400
+    
+    language = await detect_language_async(text)
+    return jsonify({'language': language})
+
 @app.route('/api/emotion_detection', methods=['POST'])
 @login_required
+@admission_controlled('vision', degraded_class='vision_fallback')
 def api_emotion_detection():
     if 'image' not in request.files:
         return jsonify({'error': 'No image provided'}), 400
@@ -405,6 +486,13 @@ def api_emotion_detection():
     
     # Process emotion detection
     try:
+        if is_degraded():
+            # Server is under load, use the cheap face-cascade path. Its
+            # guess is not logged so it cannot skew the emotion analytics
+            emotion_data = fallback_emotion_detection(image_file)
+            emotion_data['degraded'] = True
+            return jsonify(emotion_data)
+        
         emotion_data = detect_emotion(image_file)
         
         # Log the detected emotion
@@ -424,6 +512,7 @@ def api_emotion_detection():
 
 @app.route('/api/track_engagement', methods=['POST'])
 @login_required
+@admission_controlled('vision', degraded_class='vision_fallback')
 def api_track_engagement():
     if 'image' not in request.files:
         return jsonify({'error': 'No image provided'}), 400
@@ -436,7 +525,24 @@ def api_track_engagement():
     
     # Process engagement tracking
     try:
-        engagement_data = track_engagement(image_file)
+        if is_degraded():
+            # Server is under load, estimate engagement from face detection only
+            emotion_data = fallback_emotion_detection(image_file)
+            face_detected = emotion_data['emotion'] != 'unknown'
+            engagement_data = {
+                'face_detected': face_detected,
+                'eyes_detected': False,
+                'engagement_level': 0.5 if face_detected else 0.2,
+                'emotion': emotion_data['emotion'],
+                'degraded': True
+            }
+        else:
+            engagement_data = track_engagement(image_file)
+        
+        # Degraded estimates are returned to the client but never stored,
+        # so progress and analytics only ever see measured engagement
+        if engagement_data.get('degraded'):
+            return jsonify(engagement_data)
         
         # Update learning activity
         activity = LearningActivity.query.get(activity_id)
@@ -462,6 +568,107 @@ def api_track_engagement():
         logging.error(f"Error tracking engagement: {str(e)}")
         return jsonify({'error': 'Failed to track engagement'}), 500
 
+@app.route('/api/admission_status')
+@login_required
+def api_admission_status():
+    if not current_user.mentor_profile:
+        return jsonify({'error': 'Not allowed to view admission status'}), 403
+    
+    return jsonify(get_admission_status())
+
+# Cohort analytics, served from rollups kept fresh in the background.
+# The refresher starts with the first request a server process handles, so
+# CLI commands such as refresh-analytics never run one alongside their own.
+@app.before_request
+def start_background_refresh():
+    start_rollup_refresher(app)
+
+@app.route('/api/analytics/<scope>')
+@login_required
+def api_analytics(scope):
+    if scope not in ANALYTICS_SCOPES:
+        return jsonify({'error': 'Unknown analytics scope'}), 404
+    
+    scope_key = request.args.get('key') or scope_key_for_user(current_user, scope)
+    if not can_view_analytics(current_user, scope, scope_key):
+        return jsonify({'error': 'Not allowed to view these analytics'}), 403
+    
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return jsonify({'error': 'Unknown granularity'}), 400
+    
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = datetime.fromisoformat(start) if start else None
+        end = datetime.fromisoformat(end) if end else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be in ISO format (YYYY-MM-DD)'}), 400
+    
+    return jsonify(get_engagement_summary(scope, scope_key, start, end, granularity))
+
+@app.cli.command('refresh-analytics')
+def refresh_analytics_command():
+    """Fold new emotion logs and activities into the analytics rollups."""
+    folded = refresh_rollups()
+    if folded is None:
+        print('Analytics refresh failed, see the log for details')
+    else:
+        print(f"Folded {folded['emotion_logs']} emotion logs, "
+              f"{folded['activities_started']} started and "
+              f"{folded['activities_completed']} completed activities")
+
+@app.cli.command('ingest-content')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['jsonl', 'csv']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, help='Lessons per insert batch.')
+@click.option('--translate', is_flag=True, help='Queue translations into every other supported language.')
+def ingest_content_command(path, file_format, batch_size, translate):
+    """Bulk load lessons from a JSONL or CSV file."""
+    stats = ingest_content(path, file_format, batch_size, translate)
+    if stats['fingerprinted']:
+        print(f"Fingerprinted {stats['fingerprinted']} existing lessons")
+    print(f"Read {stats['read']} lessons in {stats['seconds']}s ({stats['lessons_per_second']} lessons/s): "
+          f"{stats['inserted']} inserted, {stats['duplicates']} duplicates, {stats['invalid']} invalid, "
+          f"{stats['translation_jobs']} translations queued")
+
+@app.cli.command('translate-content')
+@click.option('--limit', default=100, show_default=True, help='Jobs to process.')
+@click.option('--concurrency', default=8, show_default=True, help='Maximum OpenAI calls in flight across all jobs.')
+def translate_content_command(limit, concurrency):
+    """Process queued lesson translations."""
+    stats = process_translation_jobs(limit, concurrency)
+    print(f"Translated {stats['done']} lessons, {stats['failed']} failed")
+
+# Leaderboards
+@app.route('/api/leaderboard')
+@login_required
+def api_leaderboard():
+    scope = request.args.get('scope', 'global')
+    window = request.args.get('window', 'all')
+    
+    if scope not in LEADERBOARD_SCOPES or window not in LEADERBOARD_WINDOWS:
+        return jsonify({'error': 'Unknown leaderboard scope or window'}), 400
+    
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'Limit must be a number'}), 400
+    
+    board = get_leaderboard(current_user, scope, window, limit)
+    if board is None:
+        return jsonify({'error': 'Leaderboard not available'}), 404
+    
+    # Attach display names to the top entries
+    user_ids = [entry['user_id'] for entry in board['top']]
+    usernames = dict(
+        User.query.with_entities(User.id, User.username).filter(User.id.in_(user_ids)).all()
+    ) if user_ids else {}
+    for entry in board['top']:
+        entry['username'] = usernames.get(entry['user_id'])
+    
+    return jsonify(board)
+
 # Voice-based navigation
 @app.route('/api/voice_command', methods=['POST'])
 def api_voice_command():
@@ -0,0 +1,341 @@
+import os
+import math
+import asyncio
+import time
+import logging
+import threading
+from functools import wraps
+from contextlib import asynccontextmanager
+from flask import jsonify, request, g
+from flask_login import current_user
+from app import db
+
+# Endpoint classes and their limits. Limits are per worker process, so the
+# effective capacity of a deployment is these numbers times the worker count.
+ENDPOINT_CLASSES = {
+    # OpenAI-backed routes: slow, I/O bound, billed per call. The AI views are
+    # async, but max_concurrent still caps how many of them wait on OpenAI at
+    # once in each worker; raise it (with gunicorn --threads) for more.
+    'llm': {
+        'max_concurrent': int(os.environ.get("ADMISSION_LLM_CONCURRENCY", 4)),
+        'max_queue': int(os.environ.get("ADMISSION_LLM_QUEUE", 8)),
+        'queue_timeout': float(os.environ.get("ADMISSION_LLM_QUEUE_TIMEOUT", 2.0)),
+        'rate': float(os.environ.get("ADMISSION_LLM_RATE", 0.2)),  # tokens per second per user
+        'burst': int(os.environ.get("ADMISSION_LLM_BURST", 3)),
+    },
+    # DeepFace inference: CPU heavy
+    'vision': {
+        'max_concurrent': int(os.environ.get("ADMISSION_VISION_CONCURRENCY", 2)),
+        'max_queue': int(os.environ.get("ADMISSION_VISION_QUEUE", 4)),
+        'queue_timeout': float(os.environ.get("ADMISSION_VISION_QUEUE_TIMEOUT", 0.5)),
+        'rate': float(os.environ.get("ADMISSION_VISION_RATE", 1.0)),
+        'burst': int(os.environ.get("ADMISSION_VISION_BURST", 5)),
+    },
+    # Cascade-only OpenCV path used when 'vision' is saturated
+    'vision_fallback': {
+        'max_concurrent': int(os.environ.get("ADMISSION_VISION_FALLBACK_CONCURRENCY", 8)),
+        'max_queue': int(os.environ.get("ADMISSION_VISION_FALLBACK_QUEUE", 16)),
+        'queue_timeout': float(os.environ.get("ADMISSION_VISION_FALLBACK_QUEUE_TIMEOUT", 0.5)),
+        'rate': None,  # rate limiting is applied by the primary class
+        'burst': None,
+    },
+}
+
+
+class ConcurrencyLimiter:
+    """
+    Bounds the number of in-flight requests for an endpoint class, with a
+    bounded wait queue in front of it
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_service_time = 1.0  # seconds, exponentially weighted
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Take a slot, waiting up to queue_timeout. Returns False when the
+        queue is full or the wait times out.
+        """
+        with self._condition:
+            if self.in_flight < self.max_concurrent and self.waiting == 0:
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                return False
+
+            self.waiting += 1
+            try:
+                deadline = time.monotonic() + self.queue_timeout
+                while self.in_flight >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self, service_time):
+        with self._condition:
+            self.in_flight -= 1
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+            self._condition.notify()
+
+    def retry_after(self):
+        """
+        Estimate how long until a slot frees up, in whole seconds
+        """
+        with self._condition:
+            backlog = self.waiting + 1
+            estimate = self.avg_service_time * backlog / max(self.max_concurrent, 1)
+        return max(1, math.ceil(estimate))
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'queue_timeout': self.queue_timeout,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'avg_service_time': round(self.avg_service_time, 3)
+            }
+
+
+class TokenBucketLimiter:
+    """
+    Per-user token buckets: each user may burst up to `burst` requests and
+    then gets `rate` requests per second
+    """
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.limited = 0
+        self._buckets = {}  # key -> (tokens, last refill timestamp)
+        self._lock = threading.Lock()
+
+    def consume(self, key):
+        """
+        Take one token for the given key. Returns (allowed, retry_after_seconds).
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                if len(self._buckets) > self.max_keys:
+                    self._evict_full_buckets(now)
+                return True, 0
+
+            self._buckets[key] = (tokens, now)
+            self.limited += 1
+            return False, max(1, math.ceil((1 - tokens) / self.rate))
+
+    def _evict_full_buckets(self, now):
+        # A bucket that would have refilled completely carries no state
+        for key, (tokens, last) in list(self._buckets.items()):
+            if tokens + (now - last) * self.rate >= self.burst:
+                del self._buckets[key]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'tracked_users': len(self._buckets),
+                'limited': self.limited
+            }
+
+
+concurrency_limiters = {
+    name: ConcurrencyLimiter(
+        name,
+        config['max_concurrent'],
+        config['max_queue'],
+        config['queue_timeout']
+    )
+    for name, config in ENDPOINT_CLASSES.items()
+}
+
+rate_limiters = {
+    name: TokenBucketLimiter(config['rate'], config['burst'])
+    for name, config in ENDPOINT_CLASSES.items()
+    if config['rate']
+}
+
+
+def _reject(status_code, message, retry_after):
+    response = jsonify({'error': message, 'retry_after': retry_after})
+    response.status_code = status_code
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _consume_rate_limit(endpoint_class):
+    # Returns 0 if allowed, otherwise seconds until the next token
+    rate_limiter = rate_limiters.get(endpoint_class)
+    if not rate_limiter:
+        return 0
+
+    user_key = current_user.get_id() if current_user.is_authenticated else request.remote_addr
+    allowed, retry_after = rate_limiter.consume(user_key)
+    return 0 if allowed else retry_after
+
+
+def _check_rate_limit(endpoint_class):
+    retry_after = _consume_rate_limit(endpoint_class)
+    if retry_after:
+        return _reject(429, 'Too many requests, please slow down', retry_after)
+    return None
+
+
+def _admit(endpoint_class, degraded_class):
+    """
+    Acquire a slot for the request. Returns the limiter holding the slot, or
+    None if the request has to be rejected.
+
+    The request's database session is closed first, so a queued request does
+    not hold a pooled connection. Objects already loaded, such as
+    current_user, stay readable but are detached.
+    """
+    db.session.close()
+
+    limiter = concurrency_limiters[endpoint_class]
+    if limiter.acquire():
+        return limiter
+
+    if degraded_class:
+        fallback_limiter = concurrency_limiters[degraded_class]
+        if fallback_limiter.acquire():
+            logging.info(f"Admission: '{endpoint_class}' saturated, degrading to '{degraded_class}'")
+            g.admission_degraded = True
+            return fallback_limiter
+
+    return None
+
+
+def _reject_saturated(endpoint_class):
+    logging.warning(f"Admission: rejecting request for saturated class '{endpoint_class}'")
+    retry_after = concurrency_limiters[endpoint_class].retry_after()
+    return _reject(503, 'Server is busy, please try again shortly', retry_after)
+
+
+@asynccontextmanager
+async def admission_slot(endpoint_class):
+    """
+    Async context manager applying an endpoint class's limits to one step of
+    a view rather than the whole view. Yields whether the step was admitted,
+    so the view can serve a cheaper response instead of failing.
+    """
+    if _consume_rate_limit(endpoint_class):
+        yield False
+        return
+
+    limiter = await asyncio.to_thread(_admit, endpoint_class, None)
+    if not limiter:
+        yield False
+        return
+
+    start = time.monotonic()
+    try:
+        yield True
+    finally:
+        limiter.release(time.monotonic() - start)
+
+
+def admission_controlled(endpoint_class, degraded_class=None):
+    """
+    Decorator applying the per-user rate limit and concurrency limit of an
+    endpoint class to a view. When degraded_class is given and the primary
+    class is saturated, the view runs under that class instead with
+    g.admission_degraded set, so it can take a cheaper code path.
+    Works for both sync and async views.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                g.admission_degraded = False
+
+                rejection = _check_rate_limit(endpoint_class)
+                if rejection:
+                    return rejection
+
+                # Waiting for a slot blocks, so keep it off the event loop
+                limiter = await asyncio.to_thread(_admit, endpoint_class, degraded_class)
+                if not limiter:
+                    return _reject_saturated(endpoint_class)
+
+                start = time.monotonic()
+                try:
+                    return await view(*args, **kwargs)
+                finally:
+                    limiter.release(time.monotonic() - start)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.admission_degraded = False
+
+            rejection = _check_rate_limit(endpoint_class)
+            if rejection:
+                return rejection
+
+            limiter = _admit(endpoint_class, degraded_class)
+            if not limiter:
+                return _reject_saturated(endpoint_class)
+
+            start = time.monotonic()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                limiter.release(time.monotonic() - start)
+
+        return wrapper
+    return decorator
+
+
+def is_degraded():
+    """
+    Whether the current request was admitted on a degraded path
+    """
+    return g.get('admission_degraded', False)
+
+
+def get_admission_status():
+    """
+    Current limits and occupancy of every endpoint class in this worker
+    """
+    return {
+        'pid': os.getpid(),
+        'classes': {
+            name: {
+                'concurrency': limiter.snapshot(),
+                'rate_limit': rate_limiters[name].snapshot() if name in rate_limiters else None
+            }
+            for name, limiter in concurrency_limiters.items()
+        }
+    }
@@ -0,0 +1,453 @@
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import (
+    User, StudentProfile, MentorStudentRelationship, EmotionLog,
+    LearningActivity, EmotionalState, EngagementRollup, AnalyticsWatermark
+)
+
+# Rollups are kept for each of these scopes at each granularity.
+# 'class' is a grade within one school, 'grade' spans all schools.
+ANALYTICS_SCOPES = ['student', 'grade', 'class', 'school']
+GRANULARITIES = {'hour': 3600, 'day': 86400}
+
+EMOTIONS = [state.value for state in EmotionalState]
+EMOTION_INDEX = {emotion: i for i, emotion in enumerate(EMOTIONS)}
+
+MEASURE_COLUMNS = [
+    'engagement_sum', 'engagement_count', 'activities_started',
+    'activities_completed', 'session_seconds'
+]
+
+# Raw rows folded into the rollups per transaction
+BATCH_SIZE = 20000
+
+EPOCH = datetime(1970, 1, 1)
+
+# Rows younger than this are not folded yet, giving in-flight transactions
+# time to commit so rows are not skipped when they commit out of order
+FOLD_LAG = timedelta(seconds=int(os.environ.get("ANALYTICS_FOLD_LAG", 120)))
+
+# Seconds between background refreshes in each worker, 0 to disable
+REFRESH_INTERVAL = int(os.environ.get("ANALYTICS_REFRESH_INTERVAL", 60))
+
+# Watermark row every fold batch writes first, serializing refreshes
+REFRESH_LOCK = 'rollups'
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def scope_key_for_user(user, scope):
+    """
+    The rollup key a user's data is filed under for the given scope, or None
+    if the user has no such scope (e.g. no school set)
+    """
+    return cohort_keys(user.id, user.grade_level, user.school_name).get(scope)
+
+
+def cohort_keys(user_id, grade_level, school_name):
+    """
+    Keys of every cohort a user belongs to, by scope
+    """
+    school = school_name.strip() if school_name else None
+    grade = str(grade_level) if grade_level else None
+    return {
+        'student': str(user_id),
+        'grade': grade,
+        'class': f"{school}:{grade}" if school and grade else None,
+        'school': school
+    }
+
+
+def can_view_analytics(user, scope, scope_key):
+    """
+    Users can view the rollups they belong to. Mentors can also view any
+    grade, class or school, but only the students they actively mentor.
+    """
+    if scope_key is None:
+        return False
+    if scope_key == scope_key_for_user(user, scope):
+        return True
+    if not user.mentor_profile:
+        return False
+    if scope != 'student':
+        return True
+    if not scope_key.isdigit():
+        return False
+
+    relationship = MentorStudentRelationship.query.join(
+        StudentProfile, StudentProfile.id == MentorStudentRelationship.student_id
+    ).filter(
+        MentorStudentRelationship.mentor_id == user.mentor_profile.id,
+        MentorStudentRelationship.status == 'active',
+        StudentProfile.user_id == int(scope_key)
+    ).first()
+    return relationship is not None
+
+
+def _load_cohort_keys(user_ids, cache):
+    missing = [int(user_id) for user_id in user_ids if int(user_id) not in cache]
+    for i in range(0, len(missing), 1000):
+        rows = User.query.with_entities(
+            User.id, User.grade_level, User.school_name
+        ).filter(User.id.in_(missing[i:i + 1000])).all()
+        for user_id, grade_level, school_name in rows:
+            cache[user_id] = cohort_keys(user_id, grade_level, school_name)
+
+
+def _to_epoch_seconds(timestamps):
+    return np.array(timestamps, dtype='datetime64[s]').astype(np.int64)
+
+
+def _aggregate(user_ids, timestamps, measures, emotion_idx=None, scope_cache=None):
+    """
+    Group a batch of raw rows by every scope and granularity.
+
+    measures maps a rollup column to a per-row array of values to sum.
+    Returns {(scope, scope_key, granularity, period_start): {column: delta}}.
+    """
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    seconds = _to_epoch_seconds(timestamps)
+    unique_users, user_pos = np.unique(user_ids, return_inverse=True)
+    user_pos = user_pos.reshape(-1)
+
+    scope_cache = scope_cache if scope_cache is not None else {}
+    _load_cohort_keys(unique_users, scope_cache)
+
+    deltas = {}
+    for scope in ANALYTICS_SCOPES:
+        # Map each distinct user to the index of their key in this scope
+        labels = []
+        label_index = {}
+        key_of_user = np.full(len(unique_users), -1, dtype=np.int64)
+        for i, user_id in enumerate(unique_users):
+            key = scope_cache.get(int(user_id), {}).get(scope)
+            if key is None:
+                continue
+            if key not in label_index:
+                label_index[key] = len(labels)
+                labels.append(key)
+            key_of_user[i] = label_index[key]
+
+        row_key = key_of_user[user_pos]
+        valid = row_key >= 0
+        if not valid.any():
+            continue
+
+        for granularity, width in GRANULARITIES.items():
+            buckets = seconds[valid] // width
+            groups, inverse = np.unique(
+                np.stack([row_key[valid], buckets], axis=1), axis=0, return_inverse=True
+            )
+            inverse = inverse.reshape(-1)
+            n_groups = len(groups)
+
+            sums = {
+                column: np.bincount(inverse, weights=values[valid], minlength=n_groups)
+                for column, values in measures.items()
+            }
+            if emotion_idx is not None:
+                emotion_counts = np.bincount(
+                    inverse * len(EMOTIONS) + emotion_idx[valid],
+                    minlength=n_groups * len(EMOTIONS)
+                ).reshape(n_groups, len(EMOTIONS))
+
+            for g, (key_idx, bucket) in enumerate(groups):
+                period_start = EPOCH + timedelta(seconds=int(bucket) * width)
+                delta = {column: float(values[g]) for column, values in sums.items()}
+                if emotion_idx is not None:
+                    delta['emotion_counts'] = {
+                        EMOTIONS[e]: int(count)
+                        for e, count in enumerate(emotion_counts[g]) if count
+                    }
+                deltas[(scope, labels[key_idx], granularity, period_start)] = delta
+
+    return deltas
+
+
+def _merge_into_rollups(deltas):
+    """
+    Add aggregated deltas onto the stored rollup rows, creating missing ones.
+    Writes go out as executemany batches rather than one ORM object per row.
+    """
+    grouped = defaultdict(dict)
+    for (scope, scope_key, granularity, period_start), delta in deltas.items():
+        grouped[(scope, granularity)][(scope_key, period_start)] = delta
+
+    updates = []
+    inserts = []
+    for (scope, granularity), items in grouped.items():
+        scope_keys = sorted({scope_key for scope_key, _ in items})
+        periods = [period_start for _, period_start in items]
+
+        existing = {}
+        for i in range(0, len(scope_keys), 500):
+            rows = db.session.execute(
+                db.select(EngagementRollup.id, EngagementRollup.scope_key, EngagementRollup.period_start,
+                          *[getattr(EngagementRollup, column) for column in MEASURE_COLUMNS],
+                          EngagementRollup.emotion_counts)
+                .where(
+                    EngagementRollup.scope == scope,
+                    EngagementRollup.granularity == granularity,
+                    EngagementRollup.scope_key.in_(scope_keys[i:i + 500]),
+                    EngagementRollup.period_start.between(min(periods), max(periods))
+                )
+            ).all()
+            existing.update({(row.scope_key, row.period_start): row for row in rows})
+
+        for (scope_key, period_start), delta in items.items():
+            row = existing.get((scope_key, period_start))
+            values = {
+                column: (getattr(row, column) or 0 if row else 0) + delta.get(column, 0)
+                for column in MEASURE_COLUMNS
+            }
+            emotion_counts = dict(row.emotion_counts or {}) if row else {}
+            for emotion, count in delta.get('emotion_counts', {}).items():
+                emotion_counts[emotion] = emotion_counts.get(emotion, 0) + count
+            values['emotion_counts'] = emotion_counts
+            values['updated_at'] = datetime.utcnow()
+
+            if row:
+                updates.append(dict(values, id=row.id))
+            else:
+                inserts.append(dict(
+                    values,
+                    scope=scope,
+                    scope_key=scope_key,
+                    granularity=granularity,
+                    period_start=period_start
+                ))
+
+    if updates:
+        db.session.execute(db.update(EngagementRollup), updates)
+    if inserts:
+        db.session.execute(db.insert(EngagementRollup), inserts)
+
+
+def _lock_watermark(name):
+    # Row lock held until the transaction ends
+    watermark = AnalyticsWatermark.query.filter_by(name=name).with_for_update().first()
+    if watermark:
+        return watermark
+    try:
+        with db.session.begin_nested():
+            db.session.add(AnalyticsWatermark(name=name, last_id=0))
+    except IntegrityError:
+        pass  # another worker created it first
+    return AnalyticsWatermark.query.filter_by(name=name).with_for_update().first()
+
+
+def _lock_refresh():
+    """
+    Serialize fold batches across threads and processes until the current
+    transaction ends, so rollup read-modify-writes never interleave. Writing
+    the lock row takes a row lock on Postgres and the database write lock on
+    SQLite, which ignores SELECT ... FOR UPDATE.
+    """
+    touch = db.update(AnalyticsWatermark).where(
+        AnalyticsWatermark.name == REFRESH_LOCK
+    ).values(last_id=AnalyticsWatermark.last_id)
+    if db.session.execute(touch).rowcount == 0:
+        _lock_watermark(REFRESH_LOCK)
+        db.session.execute(touch)
+
+
+def _fold_table(name, id_column, time_column, columns, filters, fold_batch, scope_cache):
+    """
+    Fold the rows of one raw table in (time, id) order, one batch per
+    transaction. Rows newer than FOLD_LAG are left for a later refresh, so a
+    row whose transaction commits after a later one is still picked up.
+    """
+    folded = 0
+    cutoff = datetime.utcnow() - FOLD_LAG
+    while True:
+        _lock_refresh()
+        watermark = _lock_watermark(name)
+        last_time, last_id = watermark.last_time or EPOCH, watermark.last_id or 0
+
+        rows = db.session.query(id_column, time_column, *columns).filter(
+            *filters,
+            time_column <= cutoff,
+            or_(
+                time_column > last_time,
+                and_(time_column == last_time, id_column > last_id)
+            )
+        ).order_by(time_column, id_column).limit(BATCH_SIZE).all()
+
+        if not rows:
+            db.session.commit()
+            return folded
+
+        fold_batch(rows, scope_cache)
+        watermark.last_time, watermark.last_id = rows[-1][1], rows[-1][0]
+        db.session.commit()
+
+        folded += len(rows)
+        if len(rows) < BATCH_SIZE:
+            return folded
+
+
+def _fold_emotion_log_batch(rows, scope_cache):
+    _, timestamps, user_ids, emotions = zip(*rows)
+    emotion_idx = np.array([
+        EMOTION_INDEX[(emotion or EmotionalState.UNKNOWN).value] for emotion in emotions
+    ], dtype=np.int64)
+    _merge_into_rollups(_aggregate(user_ids, timestamps, {}, emotion_idx, scope_cache))
+
+
+def _fold_started_activity_batch(rows, scope_cache):
+    _, start_times, user_ids = zip(*rows)
+    measures = {'activities_started': np.ones(len(rows))}
+    _merge_into_rollups(_aggregate(user_ids, start_times, measures, scope_cache=scope_cache))
+
+
+def _fold_completed_activity_batch(rows, scope_cache):
+    _, end_times, user_ids, start_times, engagement_levels = zip(*rows)
+    end_seconds = _to_epoch_seconds(end_times)
+    start_seconds = _to_epoch_seconds([start or end for start, end in zip(start_times, end_times)])
+    engagement = np.array([level if level is not None else np.nan for level in engagement_levels], dtype=float)
+    has_engagement = ~np.isnan(engagement)
+
+    measures = {
+        'activities_completed': np.ones(len(rows)),
+        'session_seconds': np.maximum(end_seconds - start_seconds, 0).astype(float),
+        'engagement_sum': np.where(has_engagement, engagement, 0.0),
+        'engagement_count': has_engagement.astype(float)
+    }
+    _merge_into_rollups(_aggregate(user_ids, end_times, measures, scope_cache=scope_cache))
+
+
+def refresh_rollups():
+    """
+    Fold all raw emotion logs and learning activities recorded since the last
+    refresh into the rollup tables
+    """
+    try:
+        start = time.monotonic()
+        scope_cache = {}
+        folded = {
+            'emotion_logs': _fold_table(
+                'emotion_log', EmotionLog.id, EmotionLog.timestamp,
+                [EmotionLog.user_id, EmotionLog.emotion],
+                [EmotionLog.timestamp.isnot(None)],
+                _fold_emotion_log_batch, scope_cache
+            ),
+            'activities_started': _fold_table(
+                'activity_started', LearningActivity.id, LearningActivity.start_time,
+                [LearningActivity.user_id],
+                [LearningActivity.start_time.isnot(None)],
+                _fold_started_activity_batch, scope_cache
+            ),
+            # Activities are updated in place when completed, so these are
+            # tracked by end_time rather than by when the row was created
+            'activities_completed': _fold_table(
+                'activity_completed', LearningActivity.id, LearningActivity.end_time,
+                [LearningActivity.user_id, LearningActivity.start_time, LearningActivity.engagement_level],
+                [LearningActivity.completed == True, LearningActivity.end_time.isnot(None)],
+                _fold_completed_activity_batch, scope_cache
+            )
+        }
+        elapsed = time.monotonic() - start
+
+        total = sum(folded.values())
+        if total:
+            logging.info(f"Analytics: folded {total} rows into rollups in {elapsed:.2f}s ({total / max(elapsed, 1e-6):.0f} rows/s)")
+        return folded
+
+    except Exception as e:
+        logging.error(f"Error refreshing analytics rollups: {str(e)}")
+        db.session.rollback()
+        return None
+
+
+def _refresh_loop(app, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                refresh_rollups()
+            finally:
+                db.session.remove()
+
+
+def start_rollup_refresher(app, interval=REFRESH_INTERVAL):
+    """
+    Refresh the rollups every `interval` seconds from a daemon thread, so
+    analytics requests only ever read the rollup tables. A non-positive
+    interval disables it (use `flask refresh-analytics` from a scheduler).
+    """
+    global _refresher
+    if interval <= 0 or _refresher is not None:
+        return None
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = threading.Thread(
+                target=_refresh_loop, args=(app, interval), name='analytics-refresher', daemon=True
+            )
+            _refresher.start()
+    return _refresher
+
+
+def get_engagement_summary(scope, scope_key, start=None, end=None, granularity='day'):
+    """
+    Aggregate engagement, emotion distribution, completion rate and session
+    time for a scope over [start, end), read from the rollups
+    """
+    query = EngagementRollup.query.with_entities(
+        EngagementRollup.period_start,
+        EngagementRollup.engagement_sum,
+        EngagementRollup.engagement_count,
+        EngagementRollup.activities_started,
+        EngagementRollup.activities_completed,
+        EngagementRollup.session_seconds,
+        EngagementRollup.emotion_counts
+    ).filter(
+        EngagementRollup.scope == scope,
+        EngagementRollup.scope_key == scope_key,
+        EngagementRollup.granularity == granularity
+    )
+    if start:
+        query = query.filter(EngagementRollup.period_start >= start)
+    if end:
+        query = query.filter(EngagementRollup.period_start < end)
+
+    rows = query.order_by(EngagementRollup.period_start).all()
+
+    # columns: engagement_sum, engagement_count, started, completed, session_seconds
+    measures = np.array([row[1:6] for row in rows], dtype=float).reshape(-1, 5)
+    measures = np.nan_to_num(measures)
+    emotions = np.array([
+        [(row[6] or {}).get(emotion, 0) for emotion in EMOTIONS] for row in rows
+    ], dtype=float).reshape(-1, len(EMOTIONS))
+
+    def summarize(engagement_sum, engagement_count, started, completed, session_seconds, emotion_counts):
+        emotion_total = emotion_counts.sum()
+        return {
+            'average_engagement': float(engagement_sum / engagement_count) if engagement_count else None,
+            'activities_started': int(started),
+            'activities_completed': int(completed),
+            'completion_rate': float(min(completed / started, 1.0)) if started else None,
+            'average_session_time': float(session_seconds / completed) if completed else None,
+            'emotion_distribution': {
+                emotion: float(count / emotion_total)
+                for emotion, count in zip(EMOTIONS, emotion_counts) if count
+            } if emotion_total else {}
+        }
+
+    totals = summarize(*measures.sum(axis=0), emotions.sum(axis=0))
+    totals['scope'] = scope
+    totals['scope_key'] = scope_key
+    totals['granularity'] = granularity
+    totals['series'] = [
+        dict(period_start=row[0].isoformat(), **summarize(*measures[i], emotions[i]))
+        for i, row in enumerate(rows)
+    ]
+    return totals
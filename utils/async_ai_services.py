@@ -0,0 +1,266 @@
+import os
+import json
+import asyncio
+import logging
+from openai import AsyncOpenAI
+
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
+# Upper bound on concurrent OpenAI calls fanned out from a single request.
+# Requests that fan out are themselves admitted under the 'llm' class in
+# utils.admission_control, so ADMISSION_LLM_CONCURRENCY (per worker) caps
+# how many of them wait on OpenAI at once. Raise it together with the
+# gunicorn --threads count to get more concurrent waits per worker.
+MAX_FAN_OUT = int(os.environ.get("OPENAI_MAX_FAN_OUT", 8))
+
+# Lesson fields that are translated independently of each other
+TRANSLATABLE_FIELDS = ['title', 'introduction', 'content', 'summary', 'questions', 'activities']
+
+
+def get_async_client():
+    """
+    Create an AsyncOpenAI client for the current event loop.
+
+    Flask runs each async view in its own event loop, and the underlying HTTP
+    connection pool cannot be shared between loops, so clients are created per
+    request and should be closed with `await client.close()`.
+    """
+    return AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+
+async def _chat(client, system_prompt, user_prompt, max_tokens, json_mode=False):
+    kwargs = {}
+    if json_mode:
+        kwargs['response_format'] = {"type": "json_object"}
+
+    # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+    # do not change this unless explicitly requested by the user
+    response = await client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        max_tokens=max_tokens,
+        **kwargs
+    )
+    return response.choices[0].message.content
+
+
+def _save_generated_content(content_data, subject, difficulty, language):
+    from app import db
+    from models import LearningContent, Language
+
+    learning_content = LearningContent(
+        title=content_data["title"],
+        description=content_data["introduction"],
+        content_type="text",
+        difficulty_level=difficulty,
+        subject=subject,
+        language=Language(language),
+        content=json.dumps(content_data),
+        prerequisites="",
+        learning_outcomes=""
+    )
+    db.session.add(learning_content)
+    db.session.flush()
+    content_id = learning_content.id
+    db.session.commit()
+    return content_id
+
+
+async def generate_personalized_content_async(topic, subject, difficulty, learning_style, language, grade_level):
+    """
+    Async version of ai_services.generate_personalized_content. The database
+    insert runs in a worker thread to keep it off the event loop.
+    """
+    client = get_async_client()
+    try:
+        system_prompt = f"""
+        You are VidyAI++, an advanced educational AI tutor specializing in creating personalized learning content for students.
+        Create educational content for a grade {grade_level} student with a {learning_style} learning style.
+        The content should be on the topic of "{topic}" in the subject area of "{subject}".
+        Set the difficulty level to {difficulty} (on a scale of 1-5).
+        Present the content in {language} language.
+
+        Structure your response as a JSON object with the following fields:
+        - title: A catchy title for the content
+        - introduction: A brief introduction to the topic
+        - content: The main educational content, formatted appropriately for the student's learning style
+        - summary: A concise summary of the key points
+        - questions: 3-5 practice questions to test understanding
+        - activities: 2-3 suggested activities aligned with the student's learning style
+
+        Ensure that the content is engaging, accurate, and appropriate for the student's grade level.
+        """
+
+        content_data = json.loads(await _chat(
+            client,
+            system_prompt,
+            f"Generate educational content about {topic} in {subject}",
+            max_tokens=1500,
+            json_mode=True
+        ))
+
+        content_data["id"] = await asyncio.to_thread(
+            _save_generated_content, content_data, subject, difficulty, language
+        )
+        return content_data
+
+    except Exception as e:
+        logging.error(f"Error generating content: {str(e)}")
+        raise
+    finally:
+        await client.close()
+
+
+async def analyze_student_response_async(question, student_answer, grade_level):
+    """
+    Async version of ai_services.analyze_student_response
+    """
+    client = get_async_client()
+    try:
+        system_prompt = f"""
+        You are VidyAI++, an advanced educational AI tutor. Analyze the student's answer to the given question.
+        The student is in grade {grade_level}.
+
+        Provide your analysis as a JSON object with the following fields:
+        - correct: Boolean indicating if the answer is correct
+        - score: A score from 0 to 1
+        - feedback: Constructive feedback for the student
+        - explanation: A detailed explanation of the correct answer
+        - improvement_tips: Specific tips to help the student improve
+        """
+
+        return json.loads(await _chat(
+            client,
+            system_prompt,
+            f"Question: {question}\nStudent's Answer: {student_answer}",
+            max_tokens=800,
+            json_mode=True
+        ))
+
+    except Exception as e:
+        logging.error(f"Error analyzing student response: {str(e)}")
+        raise
+    finally:
+        await client.close()
+
+
+async def _translate_text(client, semaphore, text, source_language, target_language, failures):
+    system_prompt = f"""
+    You are VidyAI++, an advanced educational content translator.
+    Translate the content from {source_language} to {target_language}.
+    Maintain the educational value, clarity, and original structure of the content.
+    Ensure that the translation is culturally appropriate and uses age-appropriate terminology.
+    Respond with only the translated text.
+    """
+    try:
+        async with semaphore:
+            return await _chat(
+                client,
+                system_prompt,
+                f"Translate the following educational content from {source_language} to {target_language}:\n\n{text}",
+                max_tokens=1500
+            )
+    except Exception as e:
+        logging.error(f"Error translating content: {str(e)}")
+        failures.append(str(e))
+        return text  # Keep the original text, the caller sees the failure
+
+
+async def _translate_value(client, semaphore, value, source_language, target_language, failures):
+    # Strings are translated; lists and objects (e.g. {"question": ..., "answer": ...})
+    # are walked so every string inside them is translated too
+    if isinstance(value, str) and value.strip():
+        return await _translate_text(client, semaphore, value, source_language, target_language, failures)
+    if isinstance(value, list):
+        return list(await asyncio.gather(*[
+            _translate_value(client, semaphore, item, source_language, target_language, failures)
+            for item in value
+        ]))
+    if isinstance(value, dict):
+        keys = list(value)
+        translated = await asyncio.gather(*[
+            _translate_value(client, semaphore, value[key], source_language, target_language, failures)
+            for key in keys
+        ])
+        return dict(zip(keys, translated))
+    return value
+
+
+async def translate_content_async(content, source_language, target_language, semaphore=None):
+    """
+    Async version of language_services.translate_content.
+
+    Structured lessons are translated field by field (title, content, summary,
+    each question, ...) with the requests running concurrently, so the total
+    wait is roughly that of the longest field rather than the whole lesson.
+
+    Returns (translated_content, complete). When any piece fails to translate,
+    complete is False and that piece is left in the source language.
+
+    Pass a shared semaphore to cap OpenAI calls across several translations
+    running at once; otherwise each one allows up to MAX_FAN_OUT.
+    """
+    if source_language == target_language:
+        return content, True
+
+    try:
+        content_obj = json.loads(content)
+    except (TypeError, ValueError):
+        content_obj = None
+
+    client = get_async_client()
+    failures = []
+    try:
+        semaphore = semaphore or asyncio.Semaphore(MAX_FAN_OUT)
+
+        if not isinstance(content_obj, dict):
+            translated = await _translate_text(client, semaphore, content, source_language, target_language, failures)
+            return translated, not failures
+
+        fields = [field for field in TRANSLATABLE_FIELDS if field in content_obj]
+        translated = await asyncio.gather(*[
+            _translate_value(client, semaphore, content_obj[field], source_language, target_language, failures)
+            for field in fields
+        ])
+        content_obj.update(zip(fields, translated))
+
+        if failures:
+            logging.warning(f"Translation to {target_language} incomplete: {len(failures)} pieces failed")
+        return json.dumps(content_obj, ensure_ascii=False), not failures
+
+    except Exception as e:
+        logging.error(f"Error translating content: {str(e)}")
+        return content, False  # Return original content if translation fails
+    finally:
+        await client.close()
+
+
+async def detect_language_async(text):
+    """
+    Async version of language_services.detect_language
+    """
+    client = get_async_client()
+    try:
+        system_prompt = """
+        You are a language detection expert. Identify the language of the given text.
+        Respond with only the language name in lowercase (e.g., "english", "hindi", "tamil").
+        """
+
+        detected_language = (await _chat(
+            client,
+            system_prompt,
+            f"Detect the language of this text:\n\n{text[:500]}",
+            max_tokens=50
+        )).strip().lower()
+
+        supported_languages = ['english', 'hindi', 'bengali', 'tamil', 'telugu', 'marathi']
+        return detected_language if detected_language in supported_languages else 'english'
+
+    except Exception as e:
+        logging.error(f"Error detecting language: {str(e)}")
+        return 'english'  # Default to English if detection fails
+    finally:
+        await client.close()
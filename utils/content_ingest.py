@@ -0,0 +1,351 @@
+import csv
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from itertools import islice
+from app import db
+from models import LearningContent, Language, ContentFingerprint, TranslationJob
+from utils.async_ai_services import translate_content_async
+
+# Fields every lesson's JSON `content` must carry, with their expected types
+REQUIRED_CONTENT_FIELDS = {
+    'title': str,
+    'introduction': str,
+    'content': str,
+    'summary': str,
+    'questions': list
+}
+
+# Optional text columns a record may set, with their length limits (None for
+# unlimited). Checked here so one bad row cannot fail a whole insert batch.
+TEXT_COLUMN_LIMITS = {
+    name: LearningContent.__table__.c[name].type.length
+    for name in ['description', 'content_type', 'subject', 'prerequisites', 'learning_outcomes']
+}
+
+SUPPORTED_LANGUAGES = [language for language in Language if language != Language.UNKNOWN]
+
+# Log at most this many invalid rows per run, the rest are only counted
+MAX_LOGGED_ERRORS = 20
+
+
+def _read_records(path, file_format):
+    """
+    Stream (line number, record) pairs from a JSONL or CSV file
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            # Header is line 1
+            for line_number, record in enumerate(csv.DictReader(f), start=2):
+                yield line_number, record
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, ValueError(f"invalid JSON: {e}")
+
+
+def content_hash(subject, language, content_obj):
+    """
+    Fingerprint of a lesson: same subject, language and content means the same
+    lesson, regardless of key order or whitespace in the source file
+    """
+    canonical = json.dumps(
+        [subject or '', language.value, content_obj],
+        sort_keys=True, ensure_ascii=False, separators=(',', ':')
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def validate_record(record):
+    """
+    Validate one source record and turn it into LearningContent column values.
+    Raises ValueError describing the first problem found.
+    """
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("record is not an object")
+
+    content_obj = record.get('content')
+    if isinstance(content_obj, str):
+        try:
+            content_obj = json.loads(content_obj)
+        except ValueError:
+            raise ValueError("content is not valid JSON")
+    if not isinstance(content_obj, dict):
+        raise ValueError("content must be a JSON object")
+
+    for field, field_type in REQUIRED_CONTENT_FIELDS.items():
+        if not isinstance(content_obj.get(field), field_type):
+            raise ValueError(f"content.{field} is missing or not a {field_type.__name__}")
+
+    try:
+        language = Language(str(record.get('language') or 'english').strip().lower())
+    except ValueError:
+        raise ValueError(f"unsupported language '{record.get('language')}'")
+    if language == Language.UNKNOWN:
+        raise ValueError("language must be known")
+
+    try:
+        difficulty = int(record.get('difficulty_level') or 1)
+    except (TypeError, ValueError):
+        raise ValueError("difficulty_level must be a number")
+    if not 1 <= difficulty <= 5:
+        raise ValueError("difficulty_level must be between 1 and 5")
+
+    title = str(record.get('title') or content_obj['title']).strip()
+    if not title:
+        raise ValueError("title is empty")
+
+    text = {}
+    for name, max_length in TEXT_COLUMN_LIMITS.items():
+        value = record.get(name)
+        if value is None or value == '':
+            continue
+        if not isinstance(value, str):
+            raise ValueError(f"{name} must be a string")
+        if max_length and len(value) > max_length:
+            raise ValueError(f"{name} is longer than {max_length} characters")
+        text[name] = value
+
+    subject = text.get('subject')
+    return {
+        'title': title[:120],
+        'description': text.get('description') or content_obj['introduction'],
+        'content_type': text.get('content_type') or 'text',
+        'difficulty_level': difficulty,
+        'subject': subject,
+        'language': language,
+        'content': json.dumps(content_obj, ensure_ascii=False),
+        'prerequisites': text.get('prerequisites') or '',
+        'learning_outcomes': text.get('learning_outcomes') or ''
+    }, content_hash(subject, language, content_obj)
+
+
+def _insert_lessons(rows, hashes):
+    """
+    Bulk insert lessons and their fingerprints, returning the new ids in order
+    """
+    ids = db.session.execute(
+        db.insert(LearningContent).returning(LearningContent.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all()
+    db.session.execute(
+        db.insert(ContentFingerprint),
+        [{'content_hash': h, 'content_id': content_id} for h, content_id in zip(hashes, ids)]
+    )
+    return ids
+
+
+def _enqueue_translations(content_ids, languages):
+    jobs = [
+        {'content_id': content_id, 'target_language': target, 'status': 'pending'}
+        for content_id, language in zip(content_ids, languages)
+        for target in SUPPORTED_LANGUAGES
+        if target != language
+    ]
+    if jobs:
+        db.session.execute(db.insert(TranslationJob), jobs)
+    return len(jobs)
+
+
+def backfill_fingerprints(batch_size=1000):
+    """
+    Fingerprint lessons created without one (e.g. before bulk ingestion
+    existed, or by AI generation), so ingestion can skip their duplicates.
+    Lessons whose content is not a JSON object are left as they are.
+    """
+    added = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(
+            LearningContent.id, LearningContent.subject, LearningContent.language, LearningContent.content
+        ).outerjoin(
+            ContentFingerprint, ContentFingerprint.content_id == LearningContent.id
+        ).filter(
+            ContentFingerprint.content_hash.is_(None),
+            LearningContent.id > last_id
+        ).order_by(LearningContent.id).limit(batch_size).all()
+        if not rows:
+            return added
+        last_id = rows[-1][0]
+
+        fingerprints = {}
+        for content_id, subject, language, content in rows:
+            try:
+                content_obj = json.loads(content)
+            except (TypeError, ValueError):
+                continue
+            if language is None or not isinstance(content_obj, dict):
+                continue
+            # The first lesson with a given hash keeps it
+            fingerprints.setdefault(content_hash(subject, language, content_obj), content_id)
+
+        if fingerprints:
+            existing = set(db.session.execute(
+                db.select(ContentFingerprint.content_hash)
+                .where(ContentFingerprint.content_hash.in_(list(fingerprints)))
+            ).scalars())
+            new = [
+                {'content_hash': lesson_hash, 'content_id': content_id}
+                for lesson_hash, content_id in fingerprints.items() if lesson_hash not in existing
+            ]
+            if new:
+                db.session.execute(db.insert(ContentFingerprint), new)
+                added += len(new)
+        db.session.commit()
+
+
+def ingest_content(path, file_format=None, batch_size=1000, translate=False):
+    """
+    Stream lessons from a JSONL or CSV file into LearningContent.
+
+    Existing lessons without a fingerprint are fingerprinted first. Records
+    are validated and deduplicated by content hash, then inserted
+    batch_size at a time with one executemany per table, so memory use is
+    bounded by the batch size rather than the file size. With translate=True,
+    a TranslationJob is queued for every other supported language.
+    """
+    file_format = file_format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    stats = {'read': 0, 'inserted': 0, 'duplicates': 0, 'invalid': 0, 'translation_jobs': 0}
+    start = time.monotonic()
+
+    stats['fingerprinted'] = backfill_fingerprints(batch_size)
+
+    records = _read_records(path, file_format)
+    while True:
+        chunk = list(islice(records, batch_size))
+        if not chunk:
+            break
+        stats['read'] += len(chunk)
+
+        # Validate, and drop duplicates within the chunk
+        lessons = {}
+        for line_number, record in chunk:
+            try:
+                row, lesson_hash = validate_record(record)
+            except ValueError as e:
+                stats['invalid'] += 1
+                if stats['invalid'] <= MAX_LOGGED_ERRORS:
+                    logging.warning(f"Skipping line {line_number} of {path}: {e}")
+                continue
+            if lesson_hash in lessons:
+                stats['duplicates'] += 1
+            else:
+                lessons[lesson_hash] = row
+
+        # Drop lessons already in the database, including earlier chunks
+        if lessons:
+            existing = set(db.session.execute(
+                db.select(ContentFingerprint.content_hash)
+                .where(ContentFingerprint.content_hash.in_(list(lessons)))
+            ).scalars())
+            stats['duplicates'] += len(existing)
+            for lesson_hash in existing:
+                del lessons[lesson_hash]
+
+        if lessons:
+            try:
+                hashes = list(lessons)
+                rows = list(lessons.values())
+                ids = _insert_lessons(rows, hashes)
+                if translate:
+                    stats['translation_jobs'] += _enqueue_translations(ids, [row['language'] for row in rows])
+                db.session.commit()
+                stats['inserted'] += len(ids)
+            except Exception as e:
+                logging.error(f"Error inserting lessons from {path}: {str(e)}")
+                db.session.rollback()
+                raise
+
+        elapsed = time.monotonic() - start
+        logging.info(f"Ingested {stats['inserted']} of {stats['read']} lessons ({stats['read'] / max(elapsed, 1e-6):.0f} lessons/s)")
+
+    stats['seconds'] = round(time.monotonic() - start, 2)
+    stats['lessons_per_second'] = round(stats['read'] / max(stats['seconds'], 1e-6), 1)
+    return stats
+
+
+async def _translate_jobs(jobs, contents, concurrency):
+    # One semaphore across all jobs bounds the OpenAI calls in flight, however
+    # many fields each lesson fans out to
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def translate(job):
+        content = contents[job.content_id]
+        return await translate_content_async(
+            content.content, content.language.value, job.target_language.value, semaphore
+        )
+
+    return await asyncio.gather(*[translate(job) for job in jobs])
+
+
+def process_translation_jobs(limit=100, concurrency=8):
+    """
+    Translate up to `limit` pending jobs, with at most `concurrency` OpenAI
+    calls in flight, and store each result as a new LearningContent row in
+    the target language
+    """
+    # skip_locked lets several translators share the queue without overlap
+    jobs = TranslationJob.query.filter_by(status='pending').order_by(
+        TranslationJob.id
+    ).limit(limit).with_for_update(skip_locked=True).all()
+    if not jobs:
+        return {'done': 0, 'failed': 0}
+
+    contents = {
+        content.id: content
+        for content in LearningContent.query.filter(
+            LearningContent.id.in_({job.content_id for job in jobs})
+        ).all()
+    }
+    translations = asyncio.run(_translate_jobs(jobs, contents, concurrency))
+
+    stats = {'done': 0, 'failed': 0}
+    for job, (translated, complete) in zip(jobs, translations):
+        source = contents[job.content_id]
+        try:
+            content_obj = json.loads(translated)
+        except ValueError:
+            content_obj = None
+
+        # Any field left untranslated fails the whole job rather than storing
+        # a partly translated lesson
+        if not complete or not isinstance(content_obj, dict):
+            job.status = 'failed'
+            stats['failed'] += 1
+            continue
+
+        lesson_hash = content_hash(source.subject, job.target_language, content_obj)
+        if db.session.get(ContentFingerprint, lesson_hash):
+            job.status = 'done'
+            stats['done'] += 1
+            continue
+
+        translated_content = LearningContent(
+            title=(content_obj.get('title') or source.title)[:120],
+            description=content_obj.get('introduction') or source.description,
+            content_type=source.content_type,
+            difficulty_level=source.difficulty_level,
+            subject=source.subject,
+            language=job.target_language,
+            content=translated,
+            prerequisites=source.prerequisites,
+            learning_outcomes=source.learning_outcomes
+        )
+        db.session.add(translated_content)
+        db.session.flush()
+        db.session.add(ContentFingerprint(content_hash=lesson_hash, content_id=translated_content.id))
+
+        job.translated_content_id = translated_content.id
+        job.status = 'done'
+        stats['done'] += 1
+
+    db.session.commit()
+    return stats
@@ -0,0 +1,441 @@
+import os
+import math
+import random
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, inspect, or_
+from sqlalchemy.orm import Session
+from app import db
+from models import User, StudentProfile, PointsEvent
+from utils.analytics import cohort_keys
+
+LEADERBOARD_SCOPES = ['global', 'school', 'grade', 'class']
+LEADERBOARD_WINDOWS = ['all', 'week', 'month']
+
+# Events created this recently are re-read on every sync, so an event whose
+# transaction commits after one with a higher id is still applied
+SYNC_LAG = timedelta(seconds=int(os.environ.get("LEADERBOARD_SYNC_LAG", 120)))
+
+
+@event.listens_for(Session, 'before_flush')
+def _record_points_events(session, flush_context, instances):
+    """
+    Log every change to StudentProfile.points, wherever it is made, in the
+    same transaction as the change itself, including new profiles. A change
+    of school or grade is logged as a zero-point event so every worker moves
+    the user's scores.
+    """
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User) and obj in session.dirty:
+            state = inspect(obj)
+            if not any(state.attrs[name].history.has_changes() for name in ['grade_level', 'school_name']):
+                continue
+            with session.no_autoflush:
+                # Lock the profile so a concurrent points change commits
+                # either before this event or after it, never across it
+                row = session.query(StudentProfile.points).filter_by(
+                    user_id=obj.id
+                ).with_for_update().first()
+                profile = obj.student_profile
+            if row is None:
+                continue
+            points = profile.points if profile in session.dirty else row[0]
+            session.add(PointsEvent(user_id=obj.id, delta=0, points_after=points or 0))
+            continue
+
+        if not isinstance(obj, StudentProfile):
+            continue
+
+        # New profiles are logged even at 0 points, so every worker puts
+        # them on the boards rather than only those rebuilt after signup
+        if obj in session.new:
+            points_after = obj.points or 0
+            session.add(PointsEvent(user_id=obj.user_id, delta=points_after, points_after=points_after))
+            continue
+
+        history = inspect(obj).attrs.points.history
+        if not history.added:
+            continue
+
+        points_after = history.added[0] or 0
+        points_before = (history.deleted[0] if history.deleted else 0) or 0
+        if points_after != points_before:
+            session.add(PointsEvent(
+                user_id=obj.user_id,
+                delta=points_after - points_before,
+                points_after=points_after
+            ))
+
+
+class _End:
+    # Sentinel that sorts after every key
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return False
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, next, width):
+        self.key = key
+        self.next = next
+        self.width = width
+
+
+class RankedSet:
+    """
+    Indexable skip list of unique sortable keys. Insert, remove and rank
+    queries are O(log n).
+    """
+    MAX_LEVELS = 24  # comfortable for a few million keys
+
+    def __init__(self):
+        self.size = 0
+        self._nil = _Node(_End(), [], [])
+        self._head = _Node(None, [self._nil] * self.MAX_LEVELS, [1] * self.MAX_LEVELS)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not self._nil:
+            yield node.key
+            node = node.next[0]
+
+    def insert(self, key):
+        chain = [None] * self.MAX_LEVELS
+        steps_at_level = [0] * self.MAX_LEVELS
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        height = min(self.MAX_LEVELS, 1 - int(math.log(random.random(), 2.0)))
+        new_node = _Node(key, [None] * height, [None] * height)
+        steps = 0
+        for level in range(height):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain = [None] * self.MAX_LEVELS
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is self._nil or target.key != key:
+            raise KeyError(key)
+
+        for level in range(len(target.next)):
+            prev_node = chain[level]
+            prev_node.width[level] += target.width[level] - 1
+            prev_node.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def count_less(self, key):
+        """
+        Number of keys strictly smaller than key
+        """
+        position = 0
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+
+class Leaderboard:
+    """
+    Scores of one board, ordered by points (highest first) then user id
+    """
+
+    def __init__(self):
+        self.entries = RankedSet()
+        self.scores = {}
+
+    def set_score(self, user_id, score):
+        old_score = self.scores.get(user_id)
+        if old_score == score:
+            return
+        if old_score is not None:
+            self.entries.remove((-old_score, user_id))
+        self.entries.insert((-score, user_id))
+        self.scores[user_id] = score
+
+    def add_score(self, user_id, delta):
+        self.set_score(user_id, self.scores.get(user_id, 0) + delta)
+
+    def remove(self, user_id):
+        score = self.scores.pop(user_id, None)
+        if score is not None:
+            self.entries.remove((-score, user_id))
+
+    def rank(self, user_id):
+        """
+        1-based competition rank (ties share a rank), or None if not on the board
+        """
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        # Every user with strictly more points ranks above
+        return self.entries.count_less((-score, -math.inf)) + 1
+
+    def top(self, k):
+        results = []
+        for position, (negative_score, user_id) in enumerate(self.entries):
+            if position >= k:
+                break
+            score = -negative_score
+            if results and results[-1]['points'] == score:
+                rank = results[-1]['rank']
+            else:
+                rank = position + 1
+            results.append({'rank': rank, 'user_id': user_id, 'points': score})
+        return results
+
+
+def _window_starts(now):
+    today = now.date()
+    return {
+        'all': None,
+        'week': today - timedelta(days=today.weekday()),
+        'month': today.replace(day=1)
+    }
+
+
+def _board_names(cohort):
+    names = {'global': 'global'}
+    for scope in ['school', 'grade', 'class']:
+        if cohort.get(scope):
+            names[scope] = f"{scope}:{cohort[scope]}"
+    return names
+
+
+class LeaderboardService:
+    """
+    In-memory leaderboards for one worker process.
+
+    StudentProfile.points is the source of truth and PointsEvent is the change
+    log: each worker builds its boards from the database on first use, then
+    replays new events before every read, so all workers converge on the
+    same rankings without talking to each other.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._boards = {}  # (board name, window, window start) -> Leaderboard
+        self._cohorts = {}  # user_id -> cohort keys
+        self._last_event_id = 0
+        self._applied = {}  # id -> created_at of events applied within SYNC_LAG
+        self._latest_event = {}  # user_id -> id of the event behind their 'all' score
+
+    def _board(self, name, window, window_start):
+        key = (name, window, window_start)
+        if key not in self._boards:
+            self._boards[key] = Leaderboard()
+        return self._boards[key]
+
+    def _user_boards(self, user_id, window_starts):
+        return [
+            self._board(name, window, window_start)
+            for name in _board_names(self._cohorts[user_id]).values()
+            for window, window_start in window_starts.items()
+        ]
+
+    def _load_cohorts(self, user_ids):
+        """
+        Refresh cohort membership for the given users, moving their scores if
+        they changed school or grade since they were last seen
+        """
+        user_ids = list(user_ids)
+        window_starts = _window_starts(datetime.utcnow())
+        for i in range(0, len(user_ids), 1000):
+            rows = User.query.with_entities(
+                User.id, User.grade_level, User.school_name
+            ).filter(User.id.in_(user_ids[i:i + 1000])).all()
+
+            for user_id, grade_level, school_name in rows:
+                cohort = cohort_keys(user_id, grade_level, school_name)
+                old_cohort = self._cohorts.get(user_id)
+                if old_cohort is None or old_cohort == cohort:
+                    self._cohorts[user_id] = cohort
+                    continue
+
+                old_names = _board_names(old_cohort)
+                new_names = _board_names(cohort)
+                for scope in LEADERBOARD_SCOPES:
+                    if old_names.get(scope) == new_names.get(scope):
+                        continue
+                    for window, window_start in window_starts.items():
+                        score = None
+                        if scope in old_names:
+                            old_board = self._board(old_names[scope], window, window_start)
+                            score = old_board.scores.get(user_id)
+                            old_board.remove(user_id)
+                        if scope in new_names and score is not None:
+                            self._board(new_names[scope], window, window_start).set_score(user_id, score)
+                self._cohorts[user_id] = cohort
+
+    def rebuild(self):
+        """
+        Rebuild every board from the database
+        """
+        now = datetime.utcnow()
+        window_starts = _window_starts(now)
+        earliest = datetime.combine(min(window_starts['week'], window_starts['month']), datetime.min.time())
+
+        # Read the event high-water mark first: later events are replayed on
+        # top of the snapshot, and replaying an absolute total is idempotent
+        last_event_id = db.session.query(func.max(PointsEvent.id)).scalar() or 0
+
+        self._boards = {}
+        self._cohorts = {}
+        profiles = db.session.query(
+            StudentProfile.user_id, StudentProfile.points, User.grade_level, User.school_name
+        ).join(User, User.id == StudentProfile.user_id).all()
+
+        for user_id, points, grade_level, school_name in profiles:
+            self._cohorts[user_id] = cohort_keys(user_id, grade_level, school_name)
+            for name in _board_names(self._cohorts[user_id]).values():
+                self._board(name, 'all', None).set_score(user_id, points or 0)
+
+        events = db.session.query(
+            PointsEvent.id, PointsEvent.user_id, PointsEvent.delta, PointsEvent.created_at
+        ).filter(
+            PointsEvent.id <= last_event_id,
+            PointsEvent.created_at >= earliest
+        ).all()
+        self._apply_window_deltas([event[1:] for event in events], window_starts)
+
+        # Recent events are re-read by sync, remember they are already counted
+        horizon = now - SYNC_LAG
+        self._applied = {}
+        self._latest_event = {}
+        for event_id, user_id, _, created_at in events:
+            if created_at >= horizon:
+                self._applied[event_id] = created_at
+                self._latest_event[user_id] = max(event_id, self._latest_event.get(user_id, 0))
+
+        self._last_event_id = last_event_id
+        self._loaded = True
+        logging.info(f"Leaderboards rebuilt for {len(profiles)} students")
+
+    def _apply_window_deltas(self, events, window_starts):
+        for user_id, delta, created_at in events:
+            if user_id not in self._cohorts:
+                continue
+            for window in ['week', 'month']:
+                window_start = window_starts[window]
+                if created_at.date() >= window_start:
+                    for name in _board_names(self._cohorts[user_id]).values():
+                        self._board(name, window, window_start).add_score(user_id, delta)
+
+    def _drop_expired_windows(self, window_starts):
+        current = set(window_starts.values())
+        for key in [key for key in self._boards if key[2] not in current]:
+            del self._boards[key]
+
+    def sync(self):
+        """
+        Replay points changes made by any worker since the last sync
+        """
+        if not self._loaded:
+            self.rebuild()
+            return
+
+        now = datetime.utcnow()
+        window_starts = _window_starts(now)
+        self._drop_expired_windows(window_starts)
+
+        horizon = now - SYNC_LAG
+        self._applied = {
+            event_id: created_at for event_id, created_at in self._applied.items() if created_at >= horizon
+        }
+        events = [
+            event for event in db.session.query(
+                PointsEvent.id, PointsEvent.user_id, PointsEvent.delta,
+                PointsEvent.points_after, PointsEvent.created_at
+            ).filter(
+                or_(PointsEvent.id > self._last_event_id, PointsEvent.created_at >= horizon)
+            ).order_by(PointsEvent.id).all()
+            if event[0] not in self._applied
+        ]
+        if not events:
+            return
+
+        self._load_cohorts({user_id for _, user_id, _, _, _ in events})
+
+        for event_id, user_id, _, points_after, _ in events:
+            # A user's events commit in id order, so a lower id is an older total
+            if user_id not in self._cohorts or event_id < self._latest_event.get(user_id, 0):
+                continue
+            self._latest_event[user_id] = event_id
+            for name in _board_names(self._cohorts[user_id]).values():
+                self._board(name, 'all', None).set_score(user_id, points_after)
+
+        self._apply_window_deltas(
+            [(user_id, delta, created_at) for _, user_id, delta, _, created_at in events],
+            window_starts
+        )
+        self._applied.update({event_id: created_at for event_id, _, _, _, created_at in events})
+        self._last_event_id = max(self._last_event_id, events[-1][0])
+
+    def get_board(self, user, scope='global', window='all', limit=10):
+        """
+        Top entries of one of the user's boards, plus the user's own rank
+        """
+        with self._lock:
+            self.sync()
+
+            name = _board_names(cohort_keys(user.id, user.grade_level, user.school_name)).get(scope)
+            if name is None:
+                return None
+
+            window_start = _window_starts(datetime.utcnow())[window]
+            board = self._boards.get((name, window, window_start)) or Leaderboard()
+            return {
+                'board': name,
+                'window': window,
+                'window_start': window_start.isoformat() if window_start else None,
+                'size': len(board.entries),
+                'top': board.top(limit),
+                'my_rank': board.rank(user.id),
+                'my_points': board.scores.get(user.id, 0)
+            }
+
+
+leaderboards = LeaderboardService()
+
+
+def get_leaderboard(user, scope='global', window='all', limit=10):
+    """
+    Leaderboard for the given user's cohort, or None if the user has no such
+    cohort (e.g. no school set)
+    """
+    try:
+        return leaderboards.get_board(user, scope, window, limit)
+    except Exception as e:
+        logging.error(f"Error getting leaderboard: {str(e)}")
+        db.session.rollback()
+        return None